@@ -6,8 +6,10 @@ import gspread
 from google.oauth2.service_account import Credentials
 import google.generativeai as genai
 import io
+import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import matplotlib.pyplot as plt
+from urllib.parse import urlparse
 import os
 
 # === CONFIG ===
@@ -16,40 +18,170 @@ CSE_CX = os.environ["CSE_CX"]
 GEMINI_API_KEY = os.environ["GEMINI_API_KEY"]
 APIFY_API_KEY = os.environ["APIFY_API_KEY"]
 LOGO_PATH = "logo.png"
+MAX_WORKERS = 10
+HTTP_TIMEOUT = 10
+APIFY_TIMEOUT = 300
+SHEET_NAME = os.environ.get("SHEET_NAME", "Brand Social Links")
+WORKSHEET_NAME = "Sheet1"
+LINK_COLUMNS = ["Website", "Instagram", "LinkedIn"]
+RESULT_COLUMNS = ["Brand Name"] + LINK_COLUMNS
+SHEET_RANGE = "A:D"
+MAX_CAPTION_CHARS = 280
+POST_COLUMNS = {"url": "Post URL", "caption": "Caption", "takenAtDate": "Date"}
+# Path patterns for profile pages; post/reel/explore URLs are not a brand's profile
+INSTAGRAM_PATTERN = re.compile(r"^/(?!(?:p|reel|reels|explore|stories|tv|accounts)/)[^/?#]+")
+LINKEDIN_PATTERN = re.compile(r"^/company/[^/?#]+")
+SOCIAL_DOMAINS = (
+    "instagram.com", "linkedin.com", "facebook.com", "twitter.com", "x.com",
+    "tiktok.com", "youtube.com", "pinterest.com", "threads.net",
+)
 
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel("gemini-1.5-flash")
+# === Gemini model ===
+@st.cache_resource
+def get_gemini_model():
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel("gemini-1.5-flash")
 
-# === Load Google Credentials from JSON file ===
+# === Load Google Credentials from Streamlit secrets ===
 @st.cache_resource
 def get_gsheet_client():
     scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-    creds = Credentials.from_service_account_file("fresh-gravity-462706-n2-c53b22d702f7.json", scopes=scopes)
+    creds = Credentials.from_service_account_info(dict(st.secrets["gcp_service_account"]), scopes=scopes)
     return gspread.authorize(creds)
 
+def get_spreadsheet():
+    # Open the spreadsheet once per session and reuse the handle
+    if "spreadsheet" not in st.session_state:
+        client = get_gsheet_client()
+        try:
+            st.session_state.spreadsheet = client.open(SHEET_NAME)
+        except gspread.SpreadsheetNotFound:
+            email = st.secrets["gcp_service_account"]["client_email"]
+            raise ValueError(f"Spreadsheet '{SHEET_NAME}' not found. Create it and share it with {email} as an editor.")
+    return st.session_state.spreadsheet
+
+def get_worksheet():
+    if "worksheet" not in st.session_state:
+        st.session_state.worksheet = get_spreadsheet().worksheet(WORKSHEET_NAME)
+    return st.session_state.worksheet
+
+def read_sheet_links():
+    # Single values_get over the tool's own columns (A:D) only; anything to the right is
+    # user data and is left untouched. Row order is preserved so it stays aligned on write-back
+    values = get_spreadsheet().values_get(f"{WORKSHEET_NAME}!{SHEET_RANGE}").get("values", [])
+    rows = values[1:]
+    return [dict(zip(RESULT_COLUMNS, row + [""] * (len(RESULT_COLUMNS) - len(row)))) for row in rows]
+
+def is_resolved(record):
+    return bool(record) and any(record.get(col) for col in LINK_COLUMNS)
+
+def update_sheet(df):
+    # One atomic batch_update: a single updateCells writes the frame and clears whatever is
+    # left below it, limited to the frame's columns. Never loop append_row/update_cell,
+    # which costs one API round-trip per row
+    worksheet = get_worksheet()
+    values = [df.columns.tolist()] + df.astype(str).values.tolist()
+    rows = [{"values": [{"userEnteredValue": {"stringValue": v}} for v in row]} for row in values]
+    requests_body = []
+    if len(values) > worksheet.row_count:
+        # updateCells does not grow the grid, so extend it within the same batch
+        requests_body.append({"appendDimension": {
+            "sheetId": worksheet.id,
+            "dimension": "ROWS",
+            "length": len(values) - worksheet.row_count,
+        }})
+    requests_body.append({
+        "updateCells": {
+            "range": {
+                "sheetId": worksheet.id,
+                "startRowIndex": 0,
+                "startColumnIndex": 0,
+                "endColumnIndex": len(df.columns),
+            },
+            "rows": rows,
+            "fields": "userEnteredValue",
+        }
+    })
+    worksheet.spreadsheet.batch_update({"requests": requests_body})
+    if len(requests_body) > 1:
+        # The grid grew; drop the cached handle so row_count is refreshed on the next sync
+        st.session_state.pop("worksheet", None)
+
+# === Shared HTTP session (keep-alive connection pooling) ===
+@st.cache_resource
+def get_http_session():
+    # One keep-alive connection per worker so concurrent lookups never re-handshake
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_resource
+def get_executor():
+    # Long-lived worker pool so reruns don't spin up fresh threads
+    return ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
 # === Google Search Utilities ===
-def search_google(query):
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False)
+def search_google(query, num=10):
+    session = get_http_session()
     url = f"https://www.googleapis.com/customsearch/v1"
-    params = {"key": CSE_API_KEY, "cx": CSE_CX, "q": query}
-    res = requests.get(url, params=params)
+    params = {"key": CSE_API_KEY, "cx": CSE_CX, "q": query, "num": num}
+    res = session.get(url, params=params, timeout=HTTP_TIMEOUT)
+    # Raise on quota/HTTP errors so failed lookups are never cached
+    res.raise_for_status()
     return res.json().get("items", [])
 
-def extract_link(results, keyword):
+def host_matches(host, domain):
+    return host == domain or host.endswith("." + domain)
+
+def classify_links(results):
+    website = instagram = linkedin = ""
     for item in results:
         link = item.get("link", "")
-        if keyword in link:
-            return link
-    return ""
+        parsed = urlparse(link)
+        host = (parsed.hostname or "").lower()
+        if host_matches(host, "instagram.com"):
+            if INSTAGRAM_PATTERN.match(parsed.path):
+                instagram = instagram or link
+        elif host_matches(host, "linkedin.com"):
+            if LINKEDIN_PATTERN.match(parsed.path):
+                linkedin = linkedin or link
+        elif host and not any(host_matches(host, d) for d in SOCIAL_DOMAINS):
+            website = website or link
+        if website and instagram and linkedin:
+            break
+    return website, instagram, linkedin
 
 def fetch_links_for_brand(brand):
-    website = extract_link(search_google(f"{brand} official site"), ".")
-    instagram = extract_link(search_google(f"{brand} site:instagram.com"), "instagram.com")
-    linkedin = extract_link(search_google(f"{brand} site:linkedin.com/company"), "linkedin.com/company")
+    # One OR-query per brand; the results are bucketed locally
+    try:
+        results = search_google(f'{brand} site:instagram.com OR site:linkedin.com/company OR "official site"')
+    except requests.RequestException:
+        results = []
+    website, instagram, linkedin = classify_links(results)
     return {"Brand Name": brand, "Website": website, "Instagram": instagram, "LinkedIn": linkedin}
 
+@st.cache_data(show_spinner=False)
+def load_brand_csv(data):
+    return pd.read_csv(io.BytesIO(data))
+
+def clean_brand_names(names):
+    # Normalize and drop duplicates before any network calls
+    names = names.dropna().astype(str).str.strip()
+    return names[names != ""].drop_duplicates().tolist()
+
 # === Instagram via Apify ===
-def scrape_instagram_apify(username):
-    handle = username.strip().split("/")[-1].replace("@", "")
+def normalize_handle(username):
+    # This is the Apify cache key, so profile URLs (with or without ?query/#fragment) and bare handles must agree
+    handle = username.strip()
+    if "/" in handle:
+        handle = urlparse(handle if "//" in handle else f"//{handle}").path
+    return handle.rstrip("/").split("/")[-1].replace("@", "")
+
+@st.cache_data(ttl=60 * 60, show_spinner=False)
+def fetch_apify_items(handle):
+    # Only successful responses are cached; every failure path raises
     api_url = "https://api.apify.com/v2/acts/dtrungtin~instagram-profile-scraper/run-sync-get-dataset-items"
     payload = {
         "usernames": [handle],
@@ -60,39 +192,46 @@ def scrape_instagram_apify(username):
         "Content-Type": "application/json",
         "Authorization": f"Bearer {APIFY_API_KEY}"
     }
+    params = {"format": "json", "clean": "true"}
+    response = get_http_session().post(api_url, headers=headers, params=params, json=payload, timeout=APIFY_TIMEOUT)
+    response.raise_for_status()
     try:
-        response = requests.post(api_url, headers=headers, json=payload)
-        response.raise_for_status()
-        try:
-            items = response.json()
-        except ValueError:
-            st.error("❌ Apify returned non-JSON response.")
-            return []
-
-        if isinstance(items, dict) and "error" in items:
-            st.error(f"❌ Apify Error: {items['error']}")
-            return []
-
-        if not isinstance(items, list):
-            st.error(f"❌ Unexpected response from Apify: {items}")
-            return []
-
-        posts = []
-        for item in items:
-            if isinstance(item, dict):
-                posts.append({
-                    "Post URL": item.get("url", ""),
-                    "Caption": item.get("caption", ""),
-                    "Date": item.get("takenAtDate", datetime.now().strftime("%Y-%m-%d"))
-                })
-        return posts
+        items = response.json()
+    except ValueError:
+        raise ValueError("Apify returned non-JSON response.")
+
+    if isinstance(items, dict) and "error" in items:
+        raise ValueError(f"Apify Error: {items['error']}")
+
+    if not isinstance(items, list):
+        raise ValueError(f"Unexpected response from Apify: {items}")
+
+    return items
 
+def scrape_instagram_apify(username):
+    empty = pd.DataFrame(columns=list(POST_COLUMNS.values()))
+    handle = normalize_handle(username)
+    try:
+        items = fetch_apify_items(handle)
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        return empty
     except Exception as e:
         st.error(f"❌ Failed to fetch posts from Apify: {e}")
-        return []
+        return empty
+
+    records = [item for item in items if isinstance(item, dict)]
+    if not records:
+        return empty
+    # Build the columnar frame directly instead of a per-post list of dicts
+    df_posts = pd.DataFrame.from_records(records).reindex(columns=list(POST_COLUMNS)).rename(columns=POST_COLUMNS)
+    return df_posts.fillna({"Post URL": "", "Caption": "", "Date": datetime.now().strftime("%Y-%m-%d")})
 
-def analyze_instagram_posts(post_list):
-    captions = "\n\n".join([f"- {p['Caption']}" for p in post_list if p['Caption']])
+@st.cache_data(ttl=60 * 60, show_spinner=False)
+def analyze_instagram_posts(df_posts):
+    # The opening of a caption is enough to read topic and tone; trim and dedupe to cut prompt tokens
+    captions = df_posts["Caption"].dropna().astype(str).str.strip()
+    captions = "\n\n".join(f"- {c[:MAX_CAPTION_CHARS]}" for c in dict.fromkeys(captions) if c)
     prompt = f"""
     You are a social media strategist. Analyze the following Instagram post captions to detect:
     1. Type of content (reels, promotions, memes, influencer, educational, etc.)
@@ -104,19 +243,25 @@ def analyze_instagram_posts(post_list):
     Captions:
     {captions}
     """
-    result = model.generate_content(prompt)
+    result = get_gemini_model().generate_content(prompt)
     return result.text
 
 # === Streamlit UI ===
-st.set_page_config(page_title="Brand Social Tool", layout="wide")
-st.markdown("""
+CSS = """
     <style>
         body { background-color: white; }
         .stButton>button { background-color: #FFD700; color: #fff; font-weight: bold; border: none; border-radius: 8px; padding: 0.5rem 1.2rem; }
         .stTextInput>div>input, .stTextArea>div>textarea { background-color: #fffbe6; border-radius: 5px; color: #FFD700; }
         .stDataFrame, .stTable { background-color: #ffffff; }
     </style>
-""", unsafe_allow_html=True)
+"""
+
+@st.cache_data(show_spinner=False)
+def get_css():
+    return CSS
+
+st.set_page_config(page_title="Brand Social Tool", layout="wide")
+st.markdown(get_css(), unsafe_allow_html=True)
 st.image(LOGO_PATH, width=150)
 
 # === Navigation ===
@@ -132,24 +277,59 @@ if page == "🔗 Brand Link Finder":
     if input_method == "Manual Entry":
         user_input = st.text_area("Enter brand names (one per line):")
         if user_input:
-            brand_names = [b.strip() for b in user_input.split("\n") if b.strip()]
+            brand_names = clean_brand_names(pd.Series(user_input.split("\n")))
     else:
         uploaded_file = st.file_uploader("Upload CSV with a 'Brand Name' column:", type=["csv"])
         if uploaded_file:
-            df_csv = pd.read_csv(uploaded_file)
+            df_csv = load_brand_csv(uploaded_file.getvalue())
             if "Brand Name" in df_csv.columns:
-                brand_names = df_csv["Brand Name"].dropna().tolist()
+                brand_names = clean_brand_names(df_csv["Brand Name"])
             else:
                 st.error("CSV must have a column named 'Brand Name'.")
 
+    sync_to_sheet = st.checkbox("Sync results to Google Sheet")
+
+    if st.button("🧹 Clear cache"):
+        st.cache_data.clear()
+        st.success("Cache cleared.")
+
     if st.button("🔍 Fetch Social Links") and brand_names:
         st.info("Fetching data... Please wait.")
-        results = [fetch_links_for_brand(brand) for brand in brand_names]
-        df_result = pd.DataFrame(results)
+        sheet_rows = []
+        if sync_to_sheet:
+            try:
+                sheet_rows = read_sheet_links()
+            except Exception as e:
+                st.error(f"❌ Failed to read Google Sheet: {e}")
+                sync_to_sheet = False
+        existing = {r["Brand Name"]: r for r in sheet_rows if r["Brand Name"]}
+        todo = [brand for brand in brand_names if not is_resolved(existing.get(brand))]
+        # CSE lookups are network-bound, so fan brands out across a thread pool
+        fetched = {r["Brand Name"]: r for r in get_executor().map(fetch_links_for_brand, todo)}
+        results = [fetched.get(brand) or existing[brand] for brand in brand_names]
+        df_result = pd.DataFrame(results, columns=RESULT_COLUMNS)
+        # Keep the result across reruns so widget clicks don't rebuild it
+        st.session_state.brand_links = {
+            "brands": tuple(brand_names),
+            "df_result": df_result,
+            "csv_bytes": df_result.to_csv(index=False).encode('utf-8'),
+        }
+        if sync_to_sheet:
+            try:
+                # Update rows in place and append new brands below, so any extra columns
+                # to the right of A:D stay on the same brand's row
+                merged = [fetched.get(r["Brand Name"], r) for r in sheet_rows]
+                merged += [r for brand, r in fetched.items() if brand not in existing]
+                update_sheet(pd.DataFrame(merged, columns=RESULT_COLUMNS))
+                st.success(f"📤 Synced to Google Sheet '{SHEET_NAME}' ({len(brand_names) - len(todo)} brands already resolved).")
+            except Exception as e:
+                st.error(f"❌ Failed to update Google Sheet: {e}")
+
+    brand_links = st.session_state.get("brand_links")
+    if brand_links and brand_links["brands"] == tuple(brand_names):
         st.success("✅ Done! Here's a preview:")
-        st.dataframe(df_result)
-        csv = df_result.to_csv(index=False).encode('utf-8')
-        st.download_button("Download CSV", data=csv, file_name="brand_links.csv", mime="text/csv")
+        st.dataframe(brand_links["df_result"])
+        st.download_button("Download CSV", data=brand_links["csv_bytes"], file_name="brand_links.csv", mime="text/csv")
 
 # === Section 2: Instagram Profile Analyzer ===
 elif page == "📸 Instagram Profile Analyzer":
@@ -158,29 +338,39 @@ elif page == "📸 Instagram Profile Analyzer":
 
     if st.button("🔍 Analyze Instagram") and handle_input:
         with st.spinner("Scraping Instagram..."):
-            try:
-                post_list = scrape_instagram_apify(handle_input)
-                if not post_list:
-                    st.warning("No posts found or profile may be private.")
-                else:
-                    df_posts = pd.DataFrame(post_list)
-                    st.dataframe(df_posts, use_container_width=True)
-                    csv_buffer = io.StringIO()
-                    df_posts.to_csv(csv_buffer, index=False)
-                    st.download_button("Download CSV", data=csv_buffer.getvalue(), file_name="instagram_posts.csv", mime="text/csv")
-
-                    st.markdown("### 📊 Posting Frequency")
-                    df_posts['Date'] = pd.to_datetime(df_posts['Date'], errors='coerce')
-                    df_freq = df_posts.groupby(df_posts['Date'].dt.date).size()
-                    fig, ax = plt.subplots()
-                    df_freq.plot(kind='bar', ax=ax)
-                    ax.set_xlabel("Date")
-                    ax.set_ylabel("# of Posts")
-                    st.pyplot(fig)
-
-                    with st.spinner("Analyzing with Gemini..."):
-                        insights = analyze_instagram_posts(post_list)
-                        st.markdown("### 🔎 Campaign & Content Insights")
-                        st.markdown(insights)
-            except Exception as e:
-                st.error(f"Error analyzing profile: {e}")
+            df_posts = scrape_instagram_apify(handle_input)
+            if df_posts.empty:
+                st.warning("No posts found or profile may be private.")
+                st.session_state.pop("instagram", None)
+            else:
+                instagram = {
+                    "handle": normalize_handle(handle_input),
+                    "df_posts": df_posts,
+                    "csv_bytes": df_posts.to_csv(index=False).encode('utf-8'),
+                    "insights": None,
+                    "error": None,
+                }
+                # Gemini runs only on an explicit Analyze click; reruns just redisplay the stored result
+                with st.spinner("Analyzing with Gemini..."):
+                    try:
+                        instagram["insights"] = analyze_instagram_posts(df_posts)
+                    except Exception as e:
+                        instagram["error"] = f"Error analyzing profile: {e}"
+                st.session_state.instagram = instagram
+
+    instagram = st.session_state.get("instagram")
+    if handle_input and instagram and instagram["handle"] == normalize_handle(handle_input):
+        df_posts = instagram["df_posts"]
+        st.dataframe(df_posts, use_container_width=True)
+        st.download_button("Download CSV", data=instagram["csv_bytes"], file_name="instagram_posts.csv", mime="text/csv")
+
+        st.markdown("### 📊 Posting Frequency")
+        dates = pd.to_datetime(df_posts['Date'], errors='coerce')
+        df_freq = df_posts.groupby(dates.dt.date).size()
+        st.bar_chart(df_freq, x_label="Date", y_label="# of Posts")
+
+        if instagram["error"]:
+            st.error(instagram["error"])
+        else:
+            st.markdown("### 🔎 Campaign & Content Insights")
+            st.markdown(instagram["insights"])